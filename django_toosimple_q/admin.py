@@ -1,19 +1,48 @@
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+
 from django.contrib import admin
+from django.contrib.admin.utils import quote
 from django.contrib.messages.constants import SUCCESS
-from django.db.models import F
-from django.db.models.functions import Coalesce
+from django.db import connections, transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Extract
 from django.template.defaultfilters import truncatechars
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
-from django.utils.formats import date_format
+from django.utils.dateformat import format as format_date
+from django.utils.formats import get_format
 from django.utils.html import escape, format_html
 from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 from django.utils.translation import gettext_lazy as _
 
-from .models import ScheduleExec, TaskExec, WorkerStatus
+from .models import ScheduleExec, TaskExec, WorkerStatus, next_cron_due
 from .registry import schedules_registry, tasks_registry
 
+# Units used to display durations, with their length in seconds
+_UNITS = (
+    ("second", 1),
+    ("minute", 60),
+    ("hour", 60 * 60),
+    ("day", 60 * 60 * 24),
+    ("week", 60 * 60 * 24 * 7),
+    ("month", 60 * 60 * 24 * 30),
+    ("year", 60 * 60 * 24 * 365),
+)
+# Durations from which the next unit is used
+_UNITS_THRESHOLDS = [unit_seconds for _, unit_seconds in _UNITS[1:]]
+
+# TaskExec fields which may host large values
+TASK_EXEC_LARGE_FIELDS = ["args", "kwargs", "result", "error", "stdout", "stderr"]
+
+# Holds the time of the changelist being rendered by the current thread
+_changelist = threading.local()
+
 
 class AbstractQueueListFilter(admin.SimpleListFilter):
     title = _("queue")
@@ -22,15 +51,13 @@ class AbstractQueueListFilter(admin.SimpleListFilter):
     name_field = None
 
     def lookups(self, request, model_admin):
-        queues = set(item.queue for item in self.registry.values())
-        return [(q, q) for q in sorted(list(queues))]
+        queues = self.registry.names_by_queue().keys()
+        return [(q, q) for q in sorted(queues)]
 
     def queryset(self, request, queryset):
         queue = self.value()
         if queue:
-            names = [
-                item.name for item in self.registry.values() if item.queue == queue
-            ]
+            names = self.registry.names_by_queue().get(queue, [])
             return queryset.filter(**{f"{self.name_field}__in": names})
 
 
@@ -45,6 +72,45 @@ class ScheduleQueueListFilter(AbstractQueueListFilter):
 
 
 class ReadOnlyAdmin(admin.ModelAdmin):
+    def changelist_view(self, request, extra_context=None):
+        # All rows of the changelist are displayed relative to the same time
+        _changelist.now = timezone.now()
+        # Change urls are reversed once per model (see `change_url`)
+        _changelist.urls = {}
+
+        def clear_changelist(response=None):
+            _changelist.now = None
+            _changelist.urls = None
+
+        try:
+            response = super().changelist_view(request, extra_context)
+        except Exception:
+            clear_changelist()
+            raise
+        if hasattr(response, "add_post_render_callback"):
+            # the template response is rendered lazily
+            response.add_post_render_callback(clear_changelist)
+        else:
+            clear_changelist()
+        return response
+
+    @property
+    def now(self):
+        """The time of the changelist being rendered, or the current time"""
+        return getattr(_changelist, "now", None) or timezone.now()
+
+    def change_url(self, obj):
+        """The admin change url of obj, reversed only once per model for the changelist"""
+        urls = getattr(_changelist, "urls", None)
+        if urls is None:
+            urls = {}
+        url_template = urls.get(obj._meta.label)
+        if url_template is None:
+            app, model = obj._meta.app_label, obj._meta.model_name
+            url_template = reverse(f"admin:{app}_{model}_change", args=("__pk__",))
+            urls[obj._meta.label] = url_template
+        return url_template.replace("__pk__", str(quote(obj.pk)))
+
     def has_change_permission(self, request, obj=None):
         return False
 
@@ -72,7 +138,7 @@ class TaskExecAdmin(ReadOnlyAdmin):
     fieldsets = [
         (
             None,
-            {"fields": ["icon", "task_name", "state", "task_"]},
+            {"fields": ["icon", "task_name", "state", "task_", "priority"]},
         ),
         (
             "Arguments",
@@ -97,14 +163,18 @@ class TaskExecAdmin(ReadOnlyAdmin):
     ]
 
     def get_queryset(self, request):
-        # defer stdout, stderr and results which may host large values
+        # defer stdout, stderr, results and errors which may host large values
         qs = super().get_queryset(request)
-        qs = qs.defer("stdout", "stderr", "result")
-        # aggregate time for an unique field
-        qs = qs.annotate(
-            sortable_time=Coalesce("finished", "started", "due", "created"),
-            execution_time=F("finished") - F("started"),
-        )
+        qs = qs.defer("stdout", "stderr", "result", "error")
+        # join the replacing task to avoid a query per row (its large values aren't
+        # deferred, as deferring through this self-referencing relation also defers
+        # them on the listed rows themselves on Django<4.2)
+        qs = qs.select_related("replaced_by")
+        execution_time = F("finished") - F("started")
+        if connections[qs.db].vendor == "postgresql":
+            # have the database return the duration as seconds
+            execution_time = Extract(execution_time, "epoch", output_field=FloatField())
+        qs = qs.annotate(execution_time=execution_time)
         return qs
 
     def arguments_(self, obj):
@@ -116,19 +186,19 @@ class TaskExecAdmin(ReadOnlyAdmin):
 
     @admin.display(ordering="due")
     def due_(self, obj):
-        return short_naturaltime(obj.due)
+        return short_naturaltime(obj.due, now=self.now)
 
     @admin.display(ordering="created")
     def created_(self, obj):
-        return short_naturaltime(obj.created)
+        return short_naturaltime(obj.created, now=self.now)
 
     @admin.display(ordering="started")
     def started_(self, obj):
-        return short_naturaltime(obj.started)
+        return short_naturaltime(obj.started, now=self.now)
 
     @admin.display(ordering="finished")
     def finished_(self, obj):
-        return short_naturaltime(obj.finished)
+        return short_naturaltime(obj.finished, now=self.now)
 
     @admin.display(ordering="sortable_time")
     def timestamp_(self, obj):
@@ -140,13 +210,18 @@ class TaskExecAdmin(ReadOnlyAdmin):
             label = "due"
         else:
             label = "created"
-        return mark_safe(f"{short_naturaltime(obj.sortable_time)} [{label}]")
+        return mark_safe(
+            f"{short_naturaltime(obj.sortable_time, now=self.now)} [{label}]"
+        )
 
     @admin.display(ordering="execution_time")
     def execution_time_(self, obj):
         if not obj.execution_time:
             return None
-        return short_seconds(obj.execution_time.seconds, additional_details=1)
+        seconds = obj.execution_time
+        if isinstance(seconds, timedelta):
+            seconds = seconds.total_seconds()
+        return short_seconds(int(seconds), additional_details=1)
 
     def replaced_by_(self, obj):
         if obj.replaced_by:
@@ -155,14 +230,26 @@ class TaskExecAdmin(ReadOnlyAdmin):
     def task_(self, obj):
         if not obj.task:
             return None
-        return render_to_string("toosimpleq/task.html", {"task": obj.task})
+        return render_task(obj.task, get_language())
 
     @admin.display(description="Requeue task")
     def action_requeue(self, request, queryset):
-        for task in queryset:
-            tasks_registry[task.task_name].enqueue(*task.args, **task.kwargs)
+        calls_by_task = defaultdict(list)
+        count = 0
+        with transaction.atomic():
+            task_execs = queryset.select_related(None).only(
+                "task_name", "args", "kwargs"
+            )
+            for task_exec in task_execs.iterator(chunk_size=500):
+                count += 1
+                calls_by_task[task_exec.task_name].append(
+                    (task_exec.args, task_exec.kwargs, None)
+                )
+            # enqueue by task, so that uniqueness is checked in bulk
+            for task_name, calls in calls_by_task.items():
+                tasks_registry[task_name].enqueue_many(calls)
         self.message_user(
-            request, f"{queryset.count()} tasks successfully requeued", level=SUCCESS
+            request, f"{count} tasks successfully requeued", level=SUCCESS
         )
 
 
@@ -196,21 +283,28 @@ class ScheduleExecAdmin(ReadOnlyAdmin):
         ),
     ]
 
+    def get_queryset(self, request):
+        # join the last task (without its large values) to avoid a query per row
+        qs = super().get_queryset(request)
+        qs = qs.select_related("last_task").defer(
+            *[f"last_task__{f}" for f in TASK_EXEC_LARGE_FIELDS]
+        )
+        return qs
+
     def schedule_(self, obj):
         if not obj.schedule:
             return None
-        return render_to_string("toosimpleq/schedule.html", {"schedule": obj.schedule})
+        return render_schedule(obj.schedule, get_language())
 
     def last_task_(self, obj):
         if obj.last_task:
-            app, model = obj.last_task._meta.app_label, obj.last_task._meta.model_name
-            edit_link = reverse(f"admin:{app}_{model}_change", args=(obj.last_task_id,))
+            edit_link = self.change_url(obj.last_task)
             return format_html('<a href="{}">{}</a>', edit_link, obj.last_task)
         return "-"
 
     @admin.display(ordering="last_due")
     def last_due_(self, obj):
-        return short_naturaltime(obj.last_due)
+        return short_naturaltime(obj.last_due, now=self.now)
 
     @admin.display()
     def next_due_(self, obj):
@@ -220,26 +314,34 @@ class ScheduleExecAdmin(ReadOnlyAdmin):
 
         if len(obj.past_dues) >= 1:
             next_due = obj.past_dues[0]
+        elif obj.schedule.cron == "manual":
+            # A manual schedule is never due
+            next_due = None
         else:
-            next_due = obj.upcomming_due
+            # Relative to the changelist time, so that all rows are consistent
+            next_due = next_cron_due(obj.schedule, self.now)
 
         if next_due is None:
             return "never"
 
-        formatted_next_due = short_naturaltime(next_due)
+        formatted_next_due = short_naturaltime(next_due, now=self.now)
         if len(obj.past_dues) > 1:
             formatted_next_due += mark_safe(f" [×{len(obj.past_dues)}]")
-        if next_due < timezone.now():
+        if next_due < self.now:
             return mark_safe(f"<span style='color: red'>{formatted_next_due}</span>")
         return formatted_next_due
 
     @admin.display(description="Force run schedule")
     def action_force_run(self, request, queryset):
-        for schedule_exec in queryset:
+        count = 0
+        # stream the rows, as only the name is needed to find the schedule
+        queryset = queryset.select_related(None).only("name")
+        for schedule_exec in queryset.iterator(chunk_size=200):
             schedule_exec.schedule.execute(dues=[None])
+            count += 1
         self.message_user(
             request,
-            f"{queryset.count()} schedules successfully executed",
+            f"{count} schedules successfully executed",
             level=SUCCESS,
         )
 
@@ -277,50 +379,70 @@ class WorkerStatusAdmin(ReadOnlyAdmin):
         ),
     ]
 
+    def get_queryset(self, request):
+        # defer the exit log which may host large values
+        qs = super().get_queryset(request)
+        qs = qs.defer("exit_log")
+        return qs
+
     @admin.display(ordering="last_tick")
     def last_tick_(self, obj):
-        return short_naturaltime(obj.last_tick)
+        return short_naturaltime(obj.last_tick, now=self.now)
 
     @admin.display(ordering="started")
     def started_(self, obj):
-        return short_naturaltime(obj.started)
+        return short_naturaltime(obj.started, now=self.now)
 
     @admin.display(ordering="stopped")
     def stopped_(self, obj):
-        return short_naturaltime(obj.stopped)
+        return short_naturaltime(obj.stopped, now=self.now)
+
+
+@lru_cache(maxsize=256)
+def render_task(task, language):
+    """Renders the description of a task (cached, as registered tasks don't change)"""
+    return render_to_string("toosimpleq/task.html", {"task": task})
+
+
+@lru_cache(maxsize=256)
+def render_schedule(schedule, language):
+    """Renders the description of a schedule (cached, as registered schedules don't change)"""
+    return render_to_string("toosimpleq/schedule.html", {"schedule": schedule})
 
 
 def short_seconds(seconds, additional_details=0):
     if seconds is None:
         return None
-    disps = [
-        (60, "second"),
-        (60 * 60, "minute"),
-        (60 * 60 * 24, "hour"),
-        (60 * 60 * 24 * 7, "day"),
-        (60 * 60 * 24 * 30, "week"),
-        (60 * 60 * 24 * 365, "month"),
-        (float("inf"), "year"),
-    ]
-    last_v = 1
-    for threshold, abbr in disps:
-        if abs(seconds) < threshold:
-            count = int(abs(seconds) // last_v)
-            plural = "s" if count > 1 else ""
-            text = f"{count} {abbr}{plural}"
-            if additional_details:
-                remainder = seconds - count * last_v
-                if remainder > 0:
-                    text += " " + short_seconds(remainder, additional_details - 1)
-            return text
-        last_v = threshold
-
-
-def short_naturaltime(datetime):
+    index = bisect_right(_UNITS_THRESHOLDS, abs(seconds))
+    name, unit_seconds = _UNITS[index]
+    count = int(abs(seconds) // unit_seconds)
+    plural = "s" if count > 1 else ""
+    text = f"{count} {name}{plural}"
+    if additional_details:
+        remainder = seconds - count * unit_seconds
+        if remainder > 0:
+            text += " " + short_seconds(remainder, additional_details - 1)
+    return text
+
+
+def short_naturaltime(datetime, now=None):
     if datetime is None:
         return None
-    seconds = (timezone.now() - datetime).total_seconds()
+    seconds = ((now or timezone.now()) - datetime).total_seconds()
     text = short_seconds(seconds)
     shorttime = f"in&nbsp;{text}" if seconds < 0 else f"{text}&nbsp;ago"
-    longtime = date_format(datetime, format="DATETIME_FORMAT", use_l10n=True)
-    return mark_safe(f'<span title="{escape(longtime)}">{shorttime}</span>')
+    longtime = long_datetime(
+        datetime,
+        get_language(),
+        timezone.get_current_timezone_name(),
+        get_format("DATETIME_FORMAT"),
+    )
+    return mark_safe(f'<span title="{longtime}">{shorttime}</span>')
+
+
+@lru_cache(maxsize=4096)
+def long_datetime(datetime, language, timezone_name, datetime_format):
+    """Returns the escaped full representation of a datetime (cached, as they often repeat,
+    keyed on the format and timezone too, as aware datetimes are equal across timezones)
+    """
+    return escape(format_date(datetime, datetime_format))
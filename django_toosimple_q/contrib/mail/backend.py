@@ -8,4 +8,6 @@ class QueueBackend(BaseEmailBackend):
         super().__init__(kwargs)
 
     def send_messages(self, email_messages):
-        send_email.queue(email_messages)
+        # One task per message, so that they are sent and retried independently
+        send_email.queue_many([(([message],), {}, None) for message in email_messages])
+        return len(email_messages)
@@ -1,8 +1,31 @@
+from contextlib import suppress
+from smtplib import SMTPServerDisconnected
+
 from django.conf import settings
 from django.core.mail import get_connection
 
 from django_toosimple_q.decorators import register_task
 
+# Opened connections by backend, reused by the following emails sent by the worker
+_connections = {}
+
+
+def get_open_connection(backend):
+    """Returns an opened connection to the backend, reusing it if possible"""
+    if backend not in _connections:
+        conn = get_connection(backend=backend)
+        conn.open()
+        _connections[backend] = conn
+    return _connections[backend]
+
+
+def close_connection(backend):
+    """Closes the reused connection, so that the next email opens a new one"""
+    conn = _connections.pop(backend, None)
+    if conn is not None:
+        with suppress(Exception):
+            conn.close()
+
 
 @register_task(unique=True, retries=10, retry_delay=3)
 def send_email(emails):
@@ -12,7 +35,13 @@ def send_email(emails):
         "django.core.mail.backends.smtp.EmailBackend",
     )
 
-    conn = get_connection(backend=backend)
-    conn.open()
-    conn.send_messages(emails)
-    conn.close()
+    try:
+        try:
+            get_open_connection(backend).send_messages(emails)
+        except SMTPServerDisconnected:
+            # The server may have closed the idle connection, so we reconnect once
+            close_connection(backend)
+            get_open_connection(backend).send_messages(emails)
+    except Exception:
+        close_connection(backend)
+        raise
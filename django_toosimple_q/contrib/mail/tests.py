@@ -2,6 +2,7 @@ import importlib
 
 from django.core import mail, management
 from django.core.mail import send_mail, send_mass_mail
+from django.core.mail.backends.locmem import EmailBackend
 from django.test.utils import override_settings
 
 from ...models import TaskExec
@@ -9,6 +10,16 @@ from ...tests.base import TooSimpleQRegularTestCase
 from . import tasks as mail_tasks
 
 
+class CountingEmailBackend(EmailBackend):
+    """An in-memory email backend counting the connections it opens"""
+
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
 class TestMail(TooSimpleQRegularTestCase):
     def setUp(self):
         super().setUp()
@@ -114,14 +125,14 @@ class TestMail(TooSimpleQRegularTestCase):
             ]
         )
 
-        self.assertQueue(1, state=TaskExec.States.QUEUED)
-        self.assertQueue(1)
+        self.assertQueue(3, state=TaskExec.States.QUEUED)
+        self.assertQueue(3)
         self.assertEquals(len(mail.outbox), 0)
 
         management.call_command("worker", "--until_done")
 
-        self.assertQueue(1, state=TaskExec.States.SUCCEEDED)
-        self.assertQueue(1)
+        self.assertQueue(3, state=TaskExec.States.SUCCEEDED)
+        self.assertQueue(3)
         self.assertEquals(len(mail.outbox), 3)
 
     @override_settings(
@@ -148,3 +159,22 @@ class TestMail(TooSimpleQRegularTestCase):
         self.assertQueue(1, state=TaskExec.States.SLEEPING)
         self.assertQueue(2)
         self.assertEquals(len(mail.outbox), 0)
+
+    @override_settings(
+        EMAIL_BACKEND="django_toosimple_q.contrib.mail.backend.QueueBackend",
+        TOOSIMPLEQ_EMAIL_BACKEND="django_toosimple_q.contrib.mail.tests.CountingEmailBackend",
+    )
+    def test_queue_mail_reuses_connection(self):
+        CountingEmailBackend.opened = 0
+
+        send_mass_mail(
+            [
+                ("Subject A", "Message.", "from@example.com", ["to@example.com"]),
+                ("Subject B", "Message.", "from@example.com", ["to@example.com"]),
+            ]
+        )
+        management.call_command("worker", "--until_done")
+
+        self.assertQueue(2, state=TaskExec.States.SUCCEEDED)
+        self.assertEquals(len(mail.outbox), 2)
+        self.assertEquals(CountingEmailBackend.opened, 1)
@@ -6,12 +6,11 @@ from .task import Task
 
 
 def register_task(**kwargs):
-    """Attaches ._task attribute, the .queue() method and adds the callable to the tasks registry"""
+    """Attaches ._task attribute, the .queue() and .queue_many() methods and adds the callable to the tasks registry"""
 
     def inner(func):
         # Default name is the qualified function name
-        if "name" not in kwargs:
-            kwargs["name"] = func.__globals__["__name__"] + "." + func.__qualname__
+        kwargs.setdefault("name", f"{func.__module__}.{func.__qualname__}")
 
         # Create the task instance
         kwargs["callable"] = func
@@ -20,8 +19,9 @@ def register_task(**kwargs):
         # Attach that instance to the callable
         func._task = task
 
-        # Include the `queue` callable
+        # Include the `queue` and `queue_many` callables
         func.queue = task.enqueue
+        func.queue_many = task.enqueue_many
 
         # Add to the registry
         tasks_registry[task.name] = task
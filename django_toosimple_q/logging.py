@@ -17,8 +17,11 @@ logger.addHandler(handler)
 def show_registry():
     """Helper functions that shows the registry contents"""
 
+    if not logger.isEnabledFor(logging.INFO):
+        return
+
     if len(schedules_registry):
-        schedules_names = ", ".join(schedules_registry.keys())
+        schedules_names = ", ".join(schedules_registry.names())
         logger.info(
             f"{len(schedules_registry)} schedules registered: {schedules_names}"
         )
@@ -26,7 +29,7 @@ def show_registry():
         logger.info("No schedules registered")
 
     if len(tasks_registry):
-        tasks_names = ", ".join(tasks_registry.keys())
+        tasks_names = ", ".join(tasks_registry.names())
         logger.info(f"{len(tasks_registry)} tasks registered: {tasks_names}")
     else:
         logger.info("No tasks registered")
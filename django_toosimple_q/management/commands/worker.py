@@ -1,20 +1,26 @@
 import datetime
 import logging
 import os
+import select
 import signal
-from time import sleep
+import socket
+import time
 from traceback import format_exc
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError, transaction
-from django.db.models import Case, Value, When
+from django.db import connection, transaction
+from django.db.models import Q
 from django.utils.timezone import now
 
 from ...logging import logger
-from ...models import ScheduleExec, TaskExec, WorkerStatus
+from ...models import ScheduleExec, TaskExec, WorkerStatus, next_cron_due
+from ...notifications import listen, wait_for_notification
 from ...registry import schedules_registry, tasks_registry
 from ...tests.utils import FakeException
 
+# Only the end of tracebacks is kept, which is where the error is
+EXIT_LOG_MAX_LENGTH = 8192
+
 
 class Command(BaseCommand):
     help = "Run tasks and schedules"
@@ -81,8 +87,17 @@ class Command(BaseCommand):
         self.label = options["label"].replace(r"{pid}", f"{os.getpid()}")
 
         self.exit_requested = False
+        # Signals interrupt the wait for the next tick by writing to a socket, which
+        # (unlike locks) is safe to do from a signal handler
+        self.wake_up_sockets = socket.socketpair()
+        for sock in self.wake_up_sockets:
+            sock.setblocking(False)
+        # On postgres, we wait for notifications of queued tasks instead of polling
+        self.listening = listen(connection)
         self.simulate_exception = False
         self.cur_task_exec = None
+        self._orphans_checked_version = None
+        self._next_schedules_due = None
 
         logger.info(f"Starting worker '{self.label}'...")
         if self.queues:
@@ -99,11 +114,12 @@ class Command(BaseCommand):
             logger.setLevel(logging.DEBUG)
 
         # On startup, we report the worker went online
-        logger.debug(f"Get or create worker instance")
+        logger.debug("Get or create worker instance")
         self.worker_status, _ = WorkerStatus.objects.update_or_create(
             label=self.label,
             defaults={
                 "started": now(),
+                "last_tick": now(),
                 "stopped": None,
                 "exit_code": None,
                 "exit_log": None,
@@ -112,6 +128,9 @@ class Command(BaseCommand):
                 "timeout": datetime.timedelta(seconds=self.timeout),
             },
         )
+        # Throttled with a monotonic clock, as the stored tick may be ahead of the
+        # current time if the system time was set back
+        self.last_tick_monotonic = time.monotonic()
 
         exc = None
 
@@ -129,21 +148,23 @@ class Command(BaseCommand):
             if self.cur_task_exec:
                 logger.critical(f"{self.cur_task_exec} got terminated !")
                 self.cur_task_exec.state = TaskExec.States.INTERRUPTED
-                self.cur_task_exec.save()
+                self.cur_task_exec.save(update_fields=["state"])
                 self.cur_task_exec.create_replacement(is_retry=False)
                 self.cur_task_exec = None
             self.worker_status.exit_code = WorkerStatus.ExitCodes.TERMINATED.value
-            self.worker_status.exit_log = format_exc()
+            self.worker_status.exit_log = format_exc()[-EXIT_LOG_MAX_LENGTH:]
 
         except Exception as e:
             exc = e
             logger.critical(f"Crashed unhandled exception: {e}")
             self.worker_status.exit_code = WorkerStatus.ExitCodes.CRASHED.value
-            self.worker_status.exit_log = format_exc()
+            self.worker_status.exit_log = format_exc()[-EXIT_LOG_MAX_LENGTH:]
 
         finally:
             self.worker_status.stopped = now()
-            self.worker_status.save()
+            self.worker_status.save(update_fields=["stopped", "exit_code", "exit_log"])
+            for sock in self.wake_up_sockets:
+                sock.close()
 
         if self.worker_status.exit_code:
             raise CommandError(returncode=self.worker_status.exit_code) from exc
@@ -151,73 +172,65 @@ class Command(BaseCommand):
     def do_loop(self) -> bool:
         """Runs one tick, returns True if it should continue looping"""
 
-        logger.debug(f"Tick !")
+        logger.debug("Tick !")
 
         last_run = now()
+        # The wait for the next tick is timed with a monotonic clock, which is not
+        # affected by system time changes
+        tick_started = time.monotonic()
 
         did_something = False
 
-        logger.debug(f"1. Update status...")
-        self.worker_status.last_tick = now()
-        self.worker_status.save()
-
-        logger.debug(f"2. Disabling orphaned schedules")
+        logger.debug("1. Update status...")
+        # Skipped when ticking in quick succession (e.g. when tasks are run back to back)
+        if tick_started - self.last_tick_monotonic >= 1:
+            self.last_tick_monotonic = tick_started
+            self.worker_status.last_tick = last_run
+            WorkerStatus.objects.filter(pk=self.worker_status.pk).update(
+                last_tick=self.worker_status.last_tick
+            )
+
+        # Orphans only appear when the registries change (typically on deploys), so
+        # they are only checked on startup and after the registries were changed
+        registries_version = (schedules_registry.version, tasks_registry.version)
+        if registries_version != self._orphans_checked_version:
+            self._disable_orphans()
+            self._orphans_checked_version = registries_version
+            self._next_schedules_due = None
+
+        # Schedules are only checked when one of them may be due (a due date is only
+        # considered as past once it's strictly before the current time)
+        if self._next_schedules_due is None or last_run > self._next_schedules_due:
+            did_something |= self._run_schedules(last_run)
+
+        logger.debug("6. Locking task")
         with transaction.atomic():
-            if (
-                ScheduleExec.objects.exclude(state=ScheduleExec.States.INVALID)
-                .exclude(name__in=schedules_registry.keys())
-                .update(state=ScheduleExec.States.INVALID)
-            ):
-                logger.warning(f"Found invalid schedules")
-
-        logger.debug(f"3. Disabling orphaned tasks")
-        with transaction.atomic():
-            if (
-                TaskExec.objects.exclude(state=TaskExec.States.INVALID)
-                .exclude(task_name__in=tasks_registry.keys())
-                .update(state=TaskExec.States.INVALID)
-            ):
-                logger.warning(f"Found invalid tasks")
-
-        logger.debug(f"4. Create missing schedules")
-        existing_schedules_names = ScheduleExec.objects.values_list("name", flat=True)
-        for schedule in self._relevant_schedules:
-            # Create the schedule exec if it does not exist
-            if schedule.name in existing_schedules_names:
-                continue
-            try:
-                last_due = None if schedule.run_on_creation else now()
-                ScheduleExec.objects.create(name=schedule.name, last_due=last_due)
-                logger.debug(f"Created schedule {schedule.name}")
-            except IntegrityError:
-                # This could happen with concurrent workers, and can be ignored
-                logger.debug(
-                    f"Schedule {schedule.name} already exists, probably created concurrently"
+            task_exec = self._build_due_tasks_qs(last_run).first()
+            if task_exec:
+                # The task is claimed only if it's still in the same state, so that it
+                # can't be picked up twice on databases without row locks (e.g. sqlite)
+                started = now()
+                claimed = TaskExec.objects.filter(
+                    pk=task_exec.pk, state=task_exec.state
+                ).update(
+                    started=started,
+                    sortable_time=started,
+                    state=TaskExec.States.PROCESSING,
+                    worker=self.worker_status,
                 )
-
-        logger.debug(f"5. Execute schedules")
-        with transaction.atomic():
-            for schedule_exec in self._build_schedules_list_qs():
-                did_something |= schedule_exec.execute()
-
-        logger.debug(f"6. Waking up tasks")
-        TaskExec.objects.filter(state=TaskExec.States.SLEEPING).filter(
-            due__lte=now()
-        ).update(state=TaskExec.States.QUEUED)
-
-        logger.debug(f"7. Locking task")
-        with transaction.atomic():
-            self.cur_task_exec = self._build_due_tasks_qs().first()
-            if self.cur_task_exec:
-                logger.debug(f"Picking up for execution : {self.cur_task_exec}")
-                self.cur_task_exec.started = now()
-                self.cur_task_exec.state = TaskExec.States.PROCESSING
-                self.cur_task_exec.worker = self.worker_status
-                self.cur_task_exec.save()
-
-        logger.debug(f"8. Running task")
+                if claimed:
+                    logger.debug("Picking up for execution : %s", task_exec)
+                    task_exec.started = task_exec.sortable_time = started
+                    task_exec.state = TaskExec.States.PROCESSING
+                    task_exec.worker = self.worker_status
+                    self.cur_task_exec = task_exec
+                else:
+                    logger.debug("%s was picked up concurrently", task_exec)
+                    did_something = True
+
+        logger.debug("7. Running task")
         if self.cur_task_exec:
-            logger.debug(f"Executing : {self.cur_task_exec}")
+            logger.debug("Executing : %s", self.cur_task_exec)
             did_something = True
             self.cur_task_exec.execute()
             self.cur_task_exec = None
@@ -239,17 +252,98 @@ class Command(BaseCommand):
             raise FakeException()
 
         if not did_something:
-            logger.debug(f"Waiting for next tick...")
-            next_run = last_run + datetime.timedelta(seconds=self.tick_duration)
-            while not self.exit_requested and now() < next_run:
-                sleep(1)
+            logger.debug("Waiting for next tick...")
+            # Sleep until the next tick, unless woken up by a signal or a notification
+            timeout = max(0, self.tick_duration - (time.monotonic() - tick_started))
+            if self.listening:
+                wait_for_notification(connection, timeout, self.wake_up_sockets[0])
+            else:
+                select.select([self.wake_up_sockets[0]], [], [], timeout)
+            try:
+                # consume the wake ups, so that they don't interrupt the next waits
+                self.wake_up_sockets[0].recv(1024)
+            except BlockingIOError:
+                pass
 
         return True
 
+    def _run_schedules(self, last_run):
+        """Creates and executes the schedules, returns True if some were due"""
+
+        logger.debug("4. Create missing schedules")
+        relevant_schedules = self._relevant_schedules
+        existing_schedules_names = set(
+            ScheduleExec.objects.filter(
+                name__in=self._relevant_schedules_names
+            ).values_list("name", flat=True)
+        )
+        missing_schedule_execs = [
+            ScheduleExec(
+                name=schedule.name,
+                last_due=None if schedule.run_on_creation else last_run,
+            )
+            for schedule in relevant_schedules
+            if schedule.name not in existing_schedules_names
+        ]
+        if missing_schedule_execs:
+            # Conflicts could happen with concurrent workers, and can be ignored
+            ScheduleExec.objects.bulk_create(
+                missing_schedule_execs, ignore_conflicts=True
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                names = ", ".join(s.name for s in missing_schedule_execs)
+                logger.debug("Created schedules %s", names)
+
+        logger.debug("5. Execute schedules")
+        did_something = False
+        next_dues = []
+        with transaction.atomic():
+            schedule_execs = list(self._build_schedules_list_qs())
+            for schedule_exec in schedule_execs:
+                did_something |= schedule_exec.execute()
+                if schedule_exec.schedule.cron != "manual":
+                    next_dues.append(
+                        next_cron_due(schedule_exec.schedule, schedule_exec.last_due)
+                    )
+
+        # Schedules locked by other workers may be due anytime, otherwise there's no
+        # need to check them again before the next due date
+        if len(schedule_execs) == len(self._relevant_schedules_names):
+            never = datetime.datetime.max.replace(tzinfo=last_run.tzinfo)
+            self._next_schedules_due = min(next_dues, default=never)
+        else:
+            self._next_schedules_due = None
+
+        return did_something
+
+    def _disable_orphans(self):
+        """Marks schedules and tasks that are not in the registries anymore as invalid"""
+
+        logger.debug("2. Disabling orphaned schedules")
+        orphaned_schedules = ScheduleExec.objects.exclude(
+            state=ScheduleExec.States.INVALID
+        ).exclude(name__in=schedules_registry.names())
+        # Orphans are rare, so we check for them before locking rows for update (the
+        # update being a single statement, it doesn't need a transaction)
+        if orphaned_schedules.exists():
+            count = orphaned_schedules.update(state=ScheduleExec.States.INVALID)
+            if count:
+                logger.warning("Found %s invalid schedules", count)
+
+        logger.debug("3. Disabling orphaned tasks")
+        orphaned_tasks = TaskExec.objects.exclude(
+            state=TaskExec.States.INVALID
+        ).exclude(task_name__in=tasks_registry.names())
+        if orphaned_tasks.exists():
+            count = orphaned_tasks.update(state=TaskExec.States.INVALID)
+            if count:
+                logger.warning("Found %s invalid tasks", count)
+
     def handle_signal(self, sig, stackframe):
         # For testing, simulates a unexpected crash of the worker
         if sig == signal.SIGUSR1:
             self.simulate_exception = True
+            self.wake()
             return
 
         # A termination signal or a second interruption signal should force exit
@@ -263,38 +357,51 @@ class Command(BaseCommand):
             if self.cur_task_exec is not None:
                 logger.critical(f"Waiting for `{self.cur_task_exec}` to finish...")
             self.exit_requested = True
+            self.wake()
+
+    def wake(self):
+        """Interrupts waiting for the next tick"""
+        try:
+            self.wake_up_sockets[1].send(b"\0")
+        except OSError:
+            # the sockets are closed once the worker exits (or the buffer is full, in
+            # which case the worker is already woken up)
+            pass
 
     @property
     def _relevant_schedules(self):
         """Get a list of schedules for this worker"""
         return schedules_registry.for_queue(self.queues, self.excluded_queues)
 
+    @property
+    def _relevant_schedules_names(self):
+        """Get the names of the schedules for this worker"""
+        return schedules_registry.names_for_queue(self.queues, self.excluded_queues)
+
     def _build_schedules_list_qs(self):
         """The queryset to select the list of schedules for update"""
 
         return ScheduleExec.objects.filter(
-            name__in=[s.name for s in self._relevant_schedules]
+            name__in=self._relevant_schedules_names
         ).select_for_update(skip_locked=True)
 
     @property
-    def _relevant_tasks(self):
-        """Get a list of tasks for this worker"""
-        return tasks_registry.for_queue(self.queues, self.excluded_queues)
+    def _relevant_tasks_names(self):
+        """Get the names of the tasks for this worker"""
+        return tasks_registry.names_for_queue(self.queues, self.excluded_queues)
 
-    def _build_due_tasks_qs(self):
+    def _build_due_tasks_qs(self, due_before):
         """The queryset to select the task due by this worker for update"""
 
-        # Build a order_by clause using the task priorities
-        whens = [
-            When(task_name=t.name, then=Value(-t.priority))
-            for t in self._relevant_tasks
-        ]
-        order_by_priority = Case(*whens, default=Value(0))
-
-        # Build the queryset
+        # Build the queryset, including sleeping tasks that are due (which saves
+        # waking them up in a separate query)
         return (
-            TaskExec.objects.filter(state=TaskExec.States.QUEUED)
-            .filter(task_name__in=[t.name for t in self._relevant_tasks])
-            .order_by(order_by_priority, "due", "created")
+            TaskExec.objects.filter(
+                Q(state=TaskExec.States.QUEUED)
+                | Q(state=TaskExec.States.SLEEPING, due__lte=due_before)
+            )
+            .filter(task_name__in=self._relevant_tasks_names)
+            .order_by("-priority", "due", "created")
+            .defer("result", "result_preview", "error", "stdout", "stderr")
             .select_for_update(skip_locked=True)
         )
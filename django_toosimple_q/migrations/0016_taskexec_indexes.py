@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("toosimpleq", "0015_taskexec_result_preview"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="taskexec",
+            index=models.Index(
+                fields=["state", "due"], name="toosimpleq_state_due_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskexec",
+            index=models.Index(
+                fields=["task_name", "state"], name="toosimpleq_name_state_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskexec",
+            index=models.Index(fields=["created"], name="toosimpleq_created_idx"),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-16 19:53
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_sortable_time(apps, schema_editor):
+    # Populate the new sortable time field
+    TaskExec = apps.get_model("toosimpleq", "TaskExec")
+    TaskExec.objects.update(
+        sortable_time=Coalesce("finished", "started", "due", "created")
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("toosimpleq", "0016_taskexec_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="taskexec",
+            name="sortable_time",
+            field=models.DateTimeField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(populate_sortable_time),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("toosimpleq", "0017_taskexec_sortable_time"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scheduleexec",
+            index=models.Index(fields=["last_due"], name="toosimpleq_last_due_idx"),
+        ),
+    ]
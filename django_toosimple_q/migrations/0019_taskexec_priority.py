@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("toosimpleq", "0018_scheduleexec_last_due_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="taskexec",
+            name="priority",
+            field=models.IntegerField(
+                default=0, help_text="copied from the task when queued"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="taskexec",
+            index=models.Index(
+                condition=models.Q(("state__in", ["QUEUED", "SLEEPING"])),
+                fields=["-priority", "due", "created"],
+                name="toosimpleq_pending_idx",
+            ),
+        ),
+    ]
@@ -4,10 +4,8 @@ from contextlib import redirect_stderr, redirect_stdout
 from datetime import datetime, timedelta
 from typing import List
 
-from croniter import croniter, croniter_range
 from django.db import models
 from django.template.defaultfilters import truncatechars
-from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
@@ -16,6 +14,28 @@ from picklefield.fields import PickledObjectField
 from .logging import logger
 from .registry import schedules_registry, tasks_registry
 
+# Icons by state, for the models below
+TASK_EXEC_ICONS = {
+    "SLEEPING": "💤",
+    "QUEUED": "⌚",
+    "PROCESSING": "🚧",
+    "SUCCEEDED": "✔️",
+    "FAILED": "❌",
+    "INTERRUPTED": "🛑",
+    "INVALID": "⚠️",
+}
+SCHEDULE_EXEC_ICONS = {
+    "ACTIVE": "🟢",
+    "INVALID": "⚠️",
+}
+WORKER_STATUS_ICONS = {
+    "ONLINE": "🟢",
+    "STOPPED": "⚪",
+    "TERMINATED": "🟧",
+    "CRASHED": "🟥",
+    "TIMEDOUT": "❓",
+}
+
 
 class TaskExec(models.Model):
     """TaskExecution represent a specific planned or past call of a task, including inputs (arguments) and outputs.
@@ -25,6 +45,21 @@ class TaskExec(models.Model):
 
     class Meta:
         verbose_name = "Task Execution"
+        indexes = [
+            models.Index(fields=["state", "due"], name="toosimpleq_state_due_idx"),
+            # picking tasks in the worker, limited to pending tasks to keep it small
+            models.Index(
+                fields=["-priority", "due", "created"],
+                name="toosimpleq_pending_idx",
+                condition=models.Q(state__in=["QUEUED", "SLEEPING"]),
+            ),
+            # unique tasks lookup and admin filters
+            models.Index(
+                fields=["task_name", "state"], name="toosimpleq_name_state_idx"
+            ),
+            # cleanup of old tasks
+            models.Index(fields=["created"], name="toosimpleq_created_idx"),
+        ]
 
     class States(models.TextChoices):
         SLEEPING = "SLEEPING", _("Sleeping")
@@ -37,21 +72,9 @@ class TaskExec(models.Model):
 
         @classmethod
         def icon(cls, state):
-            if state == cls.SLEEPING:
-                return "💤"
-            elif state == cls.QUEUED:
-                return "⌚"
-            elif state == cls.PROCESSING:
-                return "🚧"
-            elif state == cls.SUCCEEDED:
-                return "✔️"
-            elif state == cls.FAILED:
-                return "❌"
-            elif state == cls.INTERRUPTED:
-                return "🛑"
-            elif state == cls.INVALID:
-                return "⚠️"
-            raise NotImplementedError(f"Unknown state: {state}")
+            if state not in TASK_EXEC_ICONS:
+                raise NotImplementedError(f"Unknown state: {state}")
+            return TASK_EXEC_ICONS[state]
 
         @classmethod
         def todo(cls) -> List[str]:
@@ -71,6 +94,9 @@ class TaskExec(models.Model):
     task_name = models.CharField(max_length=1024)
     args = PickledObjectField(blank=True, default=list)
     kwargs = PickledObjectField(blank=True, default=dict)
+    priority = models.IntegerField(
+        default=0, help_text="copied from the task when queued"
+    )
     retries = models.IntegerField(
         default=0, help_text="retries left, -1 means infinite"
     )
@@ -83,6 +109,10 @@ class TaskExec(models.Model):
     created = models.DateTimeField(default=now)
     started = models.DateTimeField(blank=True, null=True)
     finished = models.DateTimeField(blank=True, null=True)
+    # Materialization of the latest of the times above, to allow indexed sorting
+    sortable_time = models.DateTimeField(
+        blank=True, null=True, editable=False, db_index=True
+    )
     state = models.CharField(
         max_length=32, choices=States.choices, default=States.QUEUED
     )
@@ -104,7 +134,14 @@ class TaskExec(models.Model):
     def __str__(self):
         return f"Task '{self.task_name}' {self.icon} [{self.id}]"
 
-    @property
+    def save(self, *args, **kwargs):
+        # Keep the sortable time in sync with the time fields
+        self.sortable_time = self.finished or self.started or self.due or self.created
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "sortable_time"}
+        super().save(*args, **kwargs)
+
+    @cached_property
     def task(self):
         """The corresponding task instance, or None if it's not in the registry"""
         try:
@@ -118,6 +155,8 @@ class TaskExec(models.Model):
 
     def execute(self):
         logger.info(f"{self} started")
+        # Outputs are overwritten, which also avoids loading them if they were deferred
+        self.result = self.result_preview = self.error = None
         try:
             # Get the task from the registry
             task = tasks_registry[self.task_name]
@@ -139,7 +178,17 @@ class TaskExec(models.Model):
             self.finished = now()
             self.stdout = stdout.getvalue()
             self.stderr = stderr.getvalue()
-            self.save()
+            self.save(
+                update_fields=[
+                    "state",
+                    "result",
+                    "result_preview",
+                    "error",
+                    "finished",
+                    "stdout",
+                    "stderr",
+                ]
+            )
 
     def create_replacement(self, is_retry):
         logger.info(f"Creating a replacement task for {self}")
@@ -157,18 +206,23 @@ class TaskExec(models.Model):
             task_name=self.task_name,
             args=self.args,
             kwargs=self.kwargs,
+            priority=self.priority,
             retries=retries,
             retry_delay=delay,
             state=TaskExec.States.SLEEPING,
             due=now() + timedelta(seconds=self.retry_delay),
         )
         self.replaced_by = replaced_by
-        self.save()
+        self.save(update_fields=["replaced_by"])
 
 
 class ScheduleExec(models.Model):
     class Meta:
         verbose_name = "Schedule Execution"
+        indexes = [
+            # admin ordering
+            models.Index(fields=["last_due"], name="toosimpleq_last_due_idx"),
+        ]
 
     class States(models.TextChoices):
         ACTIVE = "ACTIVE", _("Active")
@@ -176,11 +230,9 @@ class ScheduleExec(models.Model):
 
         @classmethod
         def icon(cls, state):
-            if state == cls.ACTIVE:
-                return "🟢"
-            elif state == cls.INVALID:
-                return "⚠️"
-            raise NotImplementedError(f"Unknown state: {state}")
+            if state not in SCHEDULE_EXEC_ICONS:
+                raise NotImplementedError(f"Unknown state: {state}")
+            return SCHEDULE_EXEC_ICONS[state]
 
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=1024, unique=True)
@@ -195,7 +247,7 @@ class ScheduleExec(models.Model):
     def __str__(self):
         return f"Schedule '{self.name}' {self.icon}"
 
-    @property
+    @cached_property
     def schedule(self):
         """The corresponding schedule instance, or None if it's not in the registry"""
         try:
@@ -219,26 +271,23 @@ class ScheduleExec(models.Model):
 
         if self.last_due is None:
             # If the schedule has no last due date (probaby create with run_on_creation), we run it
-            return [croniter(self.schedule.cron, now()).get_prev(datetime)]
+            return [self.schedule.croniter(now()).get_prev(datetime)]
 
-        # Otherwise, we find all execution times since last check
-        dues = list(
-            croniter_range(self.last_due, now(), self.schedule.cron, exclude_ends=True)
-        )
-        # We keep only the last one if catchup wasn't specified
+        # If catchup wasn't specified, we only need the last execution time since last check
         if not self.schedule.catch_up:
-            return dues[-1:]
+            last_due = self.schedule.croniter(now()).get_prev(datetime)
+            return [last_due] if last_due > self.last_due else []
 
+        # Otherwise, we find all execution times since last check
+        dues = []
+        until = now()
+        iterator = self.schedule.croniter(self.last_due)
+        due = iterator.get_next(datetime)
+        while due < until:
+            dues.append(due)
+            due = iterator.get_next(datetime)
         return dues
 
-    @cached_property
-    def upcomming_due(self):
-        if self.schedule.cron == "manual":
-            # A manual schedule is never due
-            return None
-
-        return croniter(self.schedule.cron, timezone.now()).get_next(datetime)
-
     def execute(self):
         did_something = False
 
@@ -248,12 +297,19 @@ class ScheduleExec(models.Model):
             did_something = True
             self.last_due = self.past_dues[-1]
 
-        self.state = ScheduleExec.States.ACTIVE
-        self.save()
+        # Only write if something changed, as this runs for each schedule at each tick
+        if did_something or self.state != ScheduleExec.States.ACTIVE:
+            self.state = ScheduleExec.States.ACTIVE
+            self.save(update_fields=["last_due", "state"])
 
         return did_something
 
 
+def next_cron_due(schedule, base):
+    """Returns the next due date of the schedule after base"""
+    return schedule.croniter(base).get_next(datetime)
+
+
 class WorkerStatus(models.Model):
     """Represents the status of a worker. At each tick, the worker will update it's status.
     After a certain tim"""
@@ -276,17 +332,9 @@ class WorkerStatus(models.Model):
 
         @classmethod
         def icon(cls, state):
-            if state == cls.ONLINE:
-                return "🟢"
-            elif state == cls.STOPPED:
-                return "⚪"
-            elif state == cls.TERMINATED:
-                return "🟧"
-            elif state == cls.CRASHED:
-                return "🟥"
-            elif state == cls.TIMEDOUT:
-                return "❓"
-            raise NotImplementedError(f"Unknown state: {state}")
+            if state not in WORKER_STATUS_ICONS:
+                raise NotImplementedError(f"Unknown state: {state}")
+            return WORKER_STATUS_ICONS[state]
 
     id = models.BigAutoField(primary_key=True)
     label = models.CharField(max_length=1024, unique=True)
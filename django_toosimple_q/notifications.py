@@ -0,0 +1,48 @@
+import select
+
+from django.db import connections
+
+# The postgres channel on which workers are notified of queued tasks
+CHANNEL = "toosimpleq"
+
+
+def notify_workers(using):
+    """Wakes up idle workers listening on postgres (sent when the transaction commits)"""
+
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"NOTIFY {CHANNEL}")
+
+
+def listen(connection):
+    """Starts listening for notifications, returns False if the connection doesn't
+    support it (only postgres with psycopg2 does)"""
+
+    if connection.vendor != "postgresql":
+        return False
+    connection.ensure_connection()
+    if not hasattr(connection.connection, "poll"):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANNEL}")
+    return True
+
+
+def wait_for_notification(connection, timeout, wake_up_fd):
+    """Waits until a notification is received, until the wake up file descriptor is
+    readable, or until the timeout expires"""
+
+    raw_connection = connection.connection
+    if raw_connection is None:
+        # the connection was closed, we can't receive notifications anymore
+        select.select([wake_up_fd], [], [], timeout)
+        return
+
+    # Notifications may have been received along previous queries
+    raw_connection.poll()
+    if not raw_connection.notifies:
+        select.select([raw_connection, wake_up_fd], [], [], timeout)
+        raw_connection.poll()
+    raw_connection.notifies.clear()
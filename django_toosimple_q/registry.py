@@ -1,11 +1,88 @@
 class Registry(dict):
+    """A dict of tasks or schedules by name, which caches lookups until it changes"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Incremented on each change, allowing users to cache derived values
+        self.version = 0
+        self._names = None
+        self._names_by_queue = None
+        self._for_queue = {}
+        self._names_for_queue = {}
+
+    def _changed(self):
+        self.version += 1
+        self._names = None
+        self._names_by_queue = None
+        self._for_queue = {}
+        self._names_for_queue = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def names(self):
+        """Returns the list of names"""
+        if self._names is None:
+            self._names = list(self.keys())
+        return self._names
+
+    def names_by_queue(self):
+        """Returns a dict of lists of names by queue"""
+        if self._names_by_queue is None:
+            names_by_queue = {}
+            for name, item in self.items():
+                names_by_queue.setdefault(item.queue, []).append(name)
+            self._names_by_queue = names_by_queue
+        return self._names_by_queue
+
+    def names_for_queue(self, queues=None, excluded_queues=None):
+        """Returns the list of names of items in the given queues"""
+        key = (tuple(queues or ()), tuple(excluded_queues or ()))
+        if key not in self._names_for_queue:
+            self._names_for_queue[key] = [
+                item.name for item in self.for_queue(queues, excluded_queues)
+            ]
+        return self._names_for_queue[key]
+
     def for_queue(self, queues=None, excluded_queues=None):
-        for item in self.values():
-            if queues and item.queue not in queues:
-                continue
-            if excluded_queues and item.queue in excluded_queues:
-                continue
-            yield item
+        """Returns the list of items in the given queues"""
+        key = (tuple(queues or ()), tuple(excluded_queues or ()))
+        if key not in self._for_queue:
+            self._for_queue[key] = [
+                item
+                for item in self.values()
+                if (not queues or item.queue in queues)
+                and (not excluded_queues or item.queue not in excluded_queues)
+            ]
+        return self._for_queue[key]
 
 
 schedules_registry = Registry()
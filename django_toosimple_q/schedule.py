@@ -1,6 +1,9 @@
+from copy import copy
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from croniter import croniter
+
 from .logging import logger
 from .task import Task
 
@@ -30,18 +33,29 @@ class Schedule:
         self.catch_up = catch_up
         self.run_on_creation = run_on_creation
 
+        # The cron expression is parsed once, and copied for each evaluation
+        self._croniter = None if cron == "manual" else croniter(cron)
+
+    def croniter(self, base: datetime) -> croniter:
+        """Returns an iterator over the cron's due dates, starting from base"""
+        iterator = copy(self._croniter)
+        iterator.set_current(base, True)
+        return iterator
+
     def execute(self, dues: List[Optional[datetime]]):
         """Enqueues the related tasks at the given due dates"""
 
-        # We enqueue the due tasks
+        # We enqueue the due tasks at once
+        calls = []
         for due in dues:
-            logger.debug(f"{self} is due at {due}")
+            logger.debug("%s is due at %s", self, due)
 
             dt_kwarg = {}
             if self.datetime_kwarg:
                 dt_kwarg = {self.datetime_kwarg: due}
 
-            self.task.enqueue(*self.args, due=due, **dt_kwarg, **self.kwargs)
+            calls.append((tuple(self.args), {**dt_kwarg, **self.kwargs}, due))
+        self.task.enqueue_many(calls)
 
     def __str__(self):
         return f"Schedule {self.name}"
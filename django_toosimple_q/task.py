@@ -1,8 +1,12 @@
+from collections import defaultdict
 from typing import Callable
 
+from django.db.models import Q, TextField
+from django.db.models.functions import Cast
 from django.utils import timezone
 
 from .logging import logger
+from .notifications import notify_workers
 
 
 class Task:
@@ -37,40 +41,163 @@ class Task:
 
         from .models import TaskExec
 
-        logger.debug(f"Enqueuing task '{self.name}'")
+        logger.debug("Enqueuing task '%s'", self.name)
 
         due_datetime = due or timezone.now()
 
         if self.unique:
-            existing_tasks = TaskExec.objects.filter(
-                task_name=self.name, args=args_, kwargs=kwargs_
+            # Queued and sleeping executions are retrieved at once
+            existing_tasks = list(
+                TaskExec.objects.filter(
+                    task_name=self.name,
+                    args=args_,
+                    kwargs=kwargs_,
+                    state__in=[TaskExec.States.QUEUED, TaskExec.States.SLEEPING],
+                )
+                .only("id", "state", "due")
+                .order_by("id")
             )
             # If already queued, we don't do anything
-            queued_task = existing_tasks.filter(state=TaskExec.States.QUEUED).first()
-            if queued_task is not None:
+            if any(t.state == TaskExec.States.QUEUED for t in existing_tasks):
                 return False
             # If there's already a same task that's sleeping
-            sleeping_task = existing_tasks.filter(
-                state=TaskExec.States.SLEEPING
-            ).first()
-            if sleeping_task is not None:
-                if due is None:
-                    # If the queuing is not delayed, we enqueue it now
-                    sleeping_task.due = due_datetime
-                    sleeping_task.state = TaskExec.States.QUEUED
-                    sleeping_task.save()
-                elif sleeping_task.due > due_datetime:
-                    # If it's delayed to less than the current due date of the task
-                    sleeping_task.due = min(sleeping_task.due, due_datetime)
-                    sleeping_task.save()
+            if existing_tasks:
+                sleeping_task = existing_tasks[0]
+                if sleeping_task.due > due_datetime:
+                    # If the queuing is not delayed, we enqueue it now, and if it's
+                    # delayed to less than the current due date, we advance it. This
+                    # only applies if the task is still sleeping, so that we don't
+                    # alter a task that was picked up concurrently. A task that is
+                    # already due is left as is, as it's picked up like queued tasks.
+                    updates = {"due": due_datetime, "sortable_time": due_datetime}
+                    if due is None:
+                        updates["state"] = TaskExec.States.QUEUED
+                    woken_up = TaskExec.objects.filter(
+                        pk=sleeping_task.pk, state=TaskExec.States.SLEEPING
+                    ).update(**updates)
+                    if woken_up and due is None:
+                        notify_workers(TaskExec.objects.db)
                 return False
 
-        return TaskExec.objects.create(
+        task_exec = self._build_task_exec(args_, kwargs_, due=due)
+        task_exec.save()
+        if task_exec.state == TaskExec.States.QUEUED:
+            notify_workers(task_exec._state.db)
+        return task_exec
+
+    def enqueue_many(self, calls):
+        """Enqueues several executions of this task at once, given as an iterable of
+        `(args, kwargs, due)` tuples, using a few queries.
+
+        Returns a list with the created TaskExec or False for each call, as if `enqueue`
+        had been called successively. On databases that can't return the ids of rows
+        created in bulk (e.g. sqlite before Django 4.0), the created TaskExecs have no
+        pk."""
+
+        from .models import TaskExec
+
+        # Arguments are stored as a tuple, like when calling `enqueue`
+        calls = [(tuple(args_), kwargs_, due) for args_, kwargs_, due in calls]
+
+        logger.debug("Enqueuing %s executions of task '%s'", len(calls), self.name)
+
+        # Arguments are compared through their pickled value, like in database lookups
+        args_field = TaskExec._meta.get_field("args")
+        kwargs_field = TaskExec._meta.get_field("kwargs")
+
+        def arguments_key(args_, kwargs_):
+            return (
+                args_field.get_db_prep_value(args_),
+                kwargs_field.get_db_prep_value(kwargs_),
+            )
+
+        # Queued or sleeping executions by arguments, including the ones created below
+        pending = defaultdict(list)
+        if self.unique:
+            # Lookup by batches, to keep the queries within the database limits
+            for i in range(0, len(calls), 100):
+                same_arguments = Q()
+                for args_, kwargs_, _ in calls[i : i + 100]:
+                    same_arguments |= Q(args=args_, kwargs=kwargs_)
+                existing_tasks = (
+                    TaskExec.objects.filter(
+                        same_arguments,
+                        task_name=self.name,
+                        state__in=[TaskExec.States.QUEUED, TaskExec.States.SLEEPING],
+                    )
+                    .only("id", "state", "due")
+                    .annotate(
+                        # the stored values, as unpickled values may pickle differently
+                        args_value=Cast("args", TextField()),
+                        kwargs_value=Cast("kwargs", TextField()),
+                    )
+                    .order_by("id")
+                )
+                for task_exec in existing_tasks:
+                    key = (task_exec.args_value, task_exec.kwargs_value)
+                    pending[key].append(task_exec)
+
+        results = []
+        to_create = []
+        to_update = {}
+        for args_, kwargs_, due in calls:
+            if self.unique:
+                key = arguments_key(args_, kwargs_)
+                existing = pending[key]
+                # If already queued, we don't do anything
+                if any(t.state == TaskExec.States.QUEUED for t in existing):
+                    results.append(False)
+                    continue
+                # If there's already a same task that's sleeping
+                sleeping_task = next(iter(existing), None)
+                if sleeping_task is not None:
+                    due_datetime = due or timezone.now()
+                    # A task that is already due is left as is, like in `enqueue`
+                    if sleeping_task.due > due_datetime:
+                        if due is None:
+                            # If the queuing is not delayed, we enqueue it now
+                            sleeping_task.state = TaskExec.States.QUEUED
+                        sleeping_task.due = due_datetime
+                        sleeping_task.sortable_time = due_datetime
+                        if sleeping_task.pk is not None:
+                            to_update[sleeping_task.pk] = sleeping_task
+                    results.append(False)
+                    continue
+
+            task_exec = self._build_task_exec(args_, kwargs_, due=due)
+            to_create.append(task_exec)
+            if self.unique:
+                pending[key].append(task_exec)
+            results.append(task_exec)
+
+        if to_update:
+            # Only applies to tasks that are still sleeping, so that we don't alter a
+            # task that was picked up concurrently (the filter is kept by bulk_update)
+            TaskExec.objects.filter(state=TaskExec.States.SLEEPING).bulk_update(
+                to_update.values(), ["state", "due", "sortable_time"]
+            )
+        TaskExec.objects.bulk_create(to_create, batch_size=500)
+        if any(
+            t.state == TaskExec.States.QUEUED for t in [*to_create, *to_update.values()]
+        ):
+            notify_workers(TaskExec.objects.db)
+        return results
+
+    def _build_task_exec(self, args_, kwargs_, due=None):
+        """Returns a new (unsaved) TaskExec instance for this task, which allows
+        creating them in bulk."""
+
+        from .models import TaskExec
+
+        due_datetime = due or timezone.now()
+        return TaskExec(
             task_name=self.name,
             args=args_,
             kwargs=kwargs_,
             state=TaskExec.States.SLEEPING if due else TaskExec.States.QUEUED,
             due=due_datetime,
+            sortable_time=due_datetime,
+            priority=self.priority,
             retries=self.retries,
             retry_delay=self.retry_delay,
         )
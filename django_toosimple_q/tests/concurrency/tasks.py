@@ -1,7 +1,8 @@
 import time
+import uuid
 
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
 from ...decorators import register_task, schedule_task
 
@@ -10,16 +11,14 @@ from ...decorators import register_task, schedule_task
 @register_task(name="create_user", queue="tasks")
 def create_user():
     time.sleep(0.5)
-    retry = 0
-    while True:
-        suffix = f"-copy{retry}" if retry > 0 else ""
-        try:
-            User.objects.create(username=f"user{suffix}")
-            break
-        except IntegrityError:
-            retry += 1
-
-    if retry > 0:
+    try:
+        # in a savepoint, so that a collision doesn't break the outer transaction
+        with transaction.atomic():
+            User.objects.create(username="user")
+    except IntegrityError:
+        # The task ran concurrently. We still create a copy of the user (with a unique
+        # name, so that we don't need to retry), so that this can be asserted.
+        User.objects.create(username=f"user-copy-{uuid.uuid4().hex}")
         raise Exception("Failed: had to rename the user")
     return 0
 
@@ -3,14 +3,27 @@ import random
 import sys
 import time
 
+from django.conf import settings
+from django.db import connection, transaction
 from django.utils import timezone
 from django.utils.formats import time_format
 
 from ...decorators import register_task, schedule_task
 from ...models import TaskExec
 
+CLEANUP_BATCH_SIZE = 1000
+# Arbitrary key of the advisory lock used by the cleanup task
+CLEANUP_LOCK_ID = 5863021
 
-@schedule_task(
+
+def demo_schedule(**kwargs):
+    """Like `schedule_task`, but only in DEBUG, so that the demo doesn't load other deployments"""
+    if not settings.DEBUG:
+        return lambda task: task
+    return schedule_task(**kwargs)
+
+
+@demo_schedule(
     cron="* * * * * */30", datetime_kwarg="scheduled_time", queue="demo", catch_up=True
 )
 @register_task(name="say_hi", queue="demo")
@@ -20,7 +33,7 @@ def say_hi(scheduled_time):
     return f"Hi at {time_format(scheduled_time)}"
 
 
-@schedule_task(cron="0 * * * * *", queue="demo")
+@demo_schedule(cron="0 * * * * *", queue="demo")
 @register_task(name="flaky", retries=3, retry_delay=2, queue="demo")
 def flaky():
     if random.random() < 0.5:
@@ -29,7 +42,7 @@ def flaky():
         return "This succeeded"
 
 
-@schedule_task(cron="0 * * * * *", queue="demo")
+@demo_schedule(cron="0 * * * * *", queue="demo")
 @register_task(name="logging", queue="demo")
 def logging():
     sys.stdout.write("This should go to standard output")
@@ -37,7 +50,7 @@ def logging():
     return "This is the result"
 
 
-@schedule_task(cron="0 */5 * * * *", queue="demo")
+@demo_schedule(cron="0 */5 * * * *", queue="demo")
 @register_task(name="long_running", queue="demo")
 def long_running():
     text = f"started at {timezone.now()}\n"
@@ -52,12 +65,41 @@ def long_running():
     return text
 
 
-@schedule_task(cron="manual", queue="demo")
+@demo_schedule(cron="manual", queue="demo")
 @register_task(name="cleanup", queue="demo", priority=-5)
 def cleanup():
+    # On postgres, an advisory lock prevents concurrent cleanups
+    use_lock = connection.vendor == "postgresql"
+    if use_lock:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [CLEANUP_LOCK_ID])
+            (locked,) = cursor.fetchone()
+        if not locked:
+            print("Skipped, as another cleanup is running")
+            return False
+
+    try:
+        deleted = _delete_old_tasks_execs()
+    finally:
+        if use_lock:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [CLEANUP_LOCK_ID])
+
+    print(f"Deleted {deleted}")
+    return True
+
+
+def _delete_old_tasks_execs():
+    # Delete in batches, so that memory usage and lock duration stay bounded
     old_tasks_execs = TaskExec.objects.filter(
         created__lte=timezone.now() - datetime.timedelta(minutes=10)
     )
-    deletes = old_tasks_execs.delete()
-    print(f"Deleted {deletes}")
-    return True
+    deleted = 0
+    while True:
+        ids = list(old_tasks_execs.values_list("pk", flat=True)[:CLEANUP_BATCH_SIZE])
+        if not ids:
+            break
+        with transaction.atomic():
+            count, _ = TaskExec.objects.filter(pk__in=ids).delete()
+        deleted += count
+    return deleted
@@ -1,5 +1,11 @@
+from datetime import timedelta
+
 from django.core import management
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from django_toosimple_q.admin import short_naturaltime, short_seconds
 from django_toosimple_q.decorators import register_task, schedule_task
 from django_toosimple_q.models import ScheduleExec, TaskExec
 
@@ -24,6 +30,56 @@ class TestAdmin(TooSimpleQRegularTestCase):
         response = self.client.get(f"/admin/toosimpleq/taskexec/{task_exec.pk}/change/")
         self.assertEqual(response.status_code, 200)
 
+    def test_task_admin_queue_filter(self):
+        """Check if the queue filter works, including after changes to the registry"""
+
+        @register_task(name="a", queue="queue_a")
+        def a():
+            return 2
+
+        a.queue()
+
+        response = self.client.get("/admin/toosimpleq/taskexec/?queue=queue_a")
+        self.assertContains(response, "queue_a")
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+        response = self.client.get("/admin/toosimpleq/taskexec/?queue=queue_b")
+        self.assertEqual(response.context["cl"].result_count, 0)
+
+        @register_task(name="b", queue="queue_b")
+        def b():
+            return 2
+
+        b.queue()
+
+        response = self.client.get("/admin/toosimpleq/taskexec/?queue=queue_b")
+        self.assertContains(response, "queue_b")
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+    def test_task_admin_queries(self):
+        """Check that the number of queries does not depend on the number of rows"""
+
+        @register_task(name="a", retries=1)
+        def a():
+            raise Exception("failing to create replacements")
+
+        def changelist_queries_count():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/admin/toosimpleq/taskexec/")
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        a.queue()
+        management.call_command("worker", "--until_done")
+        self.assertQueue(1, replaced=True)
+        count = changelist_queries_count()
+
+        for i in range(5):
+            a.queue()
+        management.call_command("worker", "--until_done")
+        self.assertQueue(6, replaced=True)
+        self.assertEqual(changelist_queries_count(), count)
+
     def test_schedule_admin(self):
         """Check if schedule admin pages work"""
 
@@ -43,6 +99,36 @@ class TestAdmin(TooSimpleQRegularTestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+    def test_schedule_admin_queries(self):
+        """Check that the number of queries does not depend on the number of rows"""
+
+        @register_task(name="a")
+        def a():
+            return 2
+
+        def changelist_queries_count():
+            management.call_command("worker", "--until_done")
+            ScheduleExec.objects.update(last_task=TaskExec.objects.first())
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/admin/toosimpleq/scheduleexec/")
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        schedule_task(cron="* * * * *", name="s0", run_on_creation=True)(a)
+        count = changelist_queries_count()
+
+        for i in range(1, 6):
+            schedule_task(cron="* * * * *", name=f"s{i}", run_on_creation=True)(a)
+        self.assertEqual(changelist_queries_count(), count)
+        self.assertEqual(ScheduleExec.objects.exclude(last_task=None).count(), 6)
+
+        # the last tasks link to their admin page
+        response = self.client.get("/admin/toosimpleq/scheduleexec/")
+        task_exec_pk = TaskExec.objects.first().pk
+        self.assertContains(
+            response, f'href="/admin/toosimpleq/taskexec/{task_exec_pk}/change/"', 6
+        )
+
     def test_manual_schedule_admin(self):
         """Check that manual schedule admin action work"""
 
@@ -136,6 +222,42 @@ class TestAdmin(TooSimpleQRegularTestCase):
         self.assertQueue(2, state=TaskExec.States.SUCCEEDED)
         self.assertQueue(0, state=TaskExec.States.QUEUED)
 
+    def test_task_admin_requeue_action_many(self):
+        """Check if the requeue action works with several tasks, including unique ones"""
+
+        @register_task(name="a")
+        def a(x):
+            return x
+
+        @register_task(name="b", unique=True)
+        def b(x):
+            return x
+
+        task_execs = [a.queue(1), a.queue(2), b.queue(1), b.queue(2)]
+
+        management.call_command("worker", "--until_done")
+
+        self.assertQueue(4, state=TaskExec.States.SUCCEEDED)
+
+        # the unique task is already queued, so it won't be requeued
+        b.queue(1)
+        self.assertQueue(1, state=TaskExec.States.QUEUED)
+
+        data = {
+            "action": "action_requeue",
+            "_selected_action": [t.pk for t in task_execs],
+        }
+        response = self.client.post("/admin/toosimpleq/taskexec/", data, follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertQueue(2, task_name="a", state=TaskExec.States.QUEUED)
+        self.assertQueue(2, task_name="b", state=TaskExec.States.QUEUED)
+
+        management.call_command("worker", "--until_done")
+
+        self.assertQueue(8, state=TaskExec.States.SUCCEEDED)
+        self.assertQueue(0, state=TaskExec.States.QUEUED)
+
     def test_task_admin_result_preview(self):
         """Check the the task results correctly displays, including if long"""
 
@@ -154,3 +276,37 @@ class TestAdmin(TooSimpleQRegularTestCase):
         management.call_command("worker", "--until_done")
         response = self.client.get("/admin/toosimpleq/taskexec/", follow=True)
         self.assertContains(response, "o" * 254 + "…")
+
+    def test_short_seconds(self):
+        """Check that durations are displayed with the right unit, including at boundaries"""
+
+        self.assertEqual(short_seconds(None), None)
+        self.assertEqual(short_seconds(5), "5 seconds")
+        self.assertEqual(short_seconds(59), "59 seconds")
+        self.assertEqual(short_seconds(60), "1 minute")
+        self.assertEqual(short_seconds(3599), "59 minutes")
+        self.assertEqual(short_seconds(3600), "1 hour")
+        self.assertEqual(short_seconds(86400 * 3), "3 days")
+        self.assertEqual(short_seconds(86400 * 14), "2 weeks")
+        self.assertEqual(short_seconds(86400 * 365), "1 year")
+        self.assertEqual(short_seconds(-3700), "1 hour")
+        self.assertEqual(short_seconds(3661, additional_details=1), "1 hour 1 minute")
+
+    def test_short_naturaltime(self):
+        """Check that times are displayed relatively to the given time"""
+
+        now = timezone.now()
+        self.assertEqual(short_naturaltime(None), None)
+        self.assertIn(
+            "2 minutes&nbsp;ago", short_naturaltime(now - timedelta(minutes=2), now=now)
+        )
+        self.assertIn(
+            "in&nbsp;3 hours", short_naturaltime(now + timedelta(hours=3), now=now)
+        )
+        # durations over a day aren't wrapped
+        self.assertIn(
+            "3 days&nbsp;ago", short_naturaltime(now - timedelta(days=3), now=now)
+        )
+        self.assertIn(
+            "in&nbsp;2 weeks", short_naturaltime(now + timedelta(days=15), now=now)
+        )
@@ -1,4 +1,8 @@
+import datetime
+
 from django.core import management
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from freezegun import freeze_time
 
 from django_toosimple_q.decorators import register_task, schedule_task
@@ -178,6 +182,65 @@ class TestSchedules(TooSimpleQRegularTestCase):
         )
         self.assertEqual(all_schedules.count(), 2)
 
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_schedule_writes(self, frozen_datetime):
+        """Testing schedules are created at once, and not written when not due"""
+
+        @register_task(name="a")
+        def a():
+            return f"Task"
+
+        for i in range(5):
+            schedule_task(cron="0 * * * *", name=f"schedule_{i}")(a)
+
+        def schedule_writes(sql_prefix):
+            with CaptureQueriesContext(connection) as queries:
+                management.call_command("worker", "--until_done")
+            return [
+                q["sql"]
+                for q in queries
+                if q["sql"].startswith(sql_prefix)
+                and '"toosimpleq_scheduleexec"' in q["sql"]
+                and '"last_due"' in q["sql"]
+            ]
+
+        self.assertEqual(len(schedule_writes("INSERT")), 1)
+        self.assertEqual(ScheduleExec.objects.count(), 5)
+
+        frozen_datetime.tick(datetime.timedelta(minutes=10))
+        self.assertEqual(schedule_writes("UPDATE"), [])
+        self.assertQueue(0)
+
+        frozen_datetime.tick(datetime.timedelta(hours=1))
+        self.assertEqual(len(schedule_writes("UPDATE")), 5)
+        self.assertQueue(5)
+
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_schedule_reads(self, frozen_datetime):
+        """Testing schedules are not queried again until one of them is due"""
+
+        @register_task(name="a")
+        def a():
+            return f"Task"
+
+        for i in range(5):
+            schedule_task(cron="0 * * * *", name=f"schedule_{i}", run_on_creation=True)(
+                a
+            )
+
+        # Schedules are queried on the first tick only (to check for orphans, for missing
+        # schedules and for due schedules), while tasks are run at next ticks
+        with CaptureQueriesContext(connection) as queries:
+            management.call_command("worker", "--until_done")
+        schedule_reads = [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith("SELECT")
+            and 'FROM "toosimpleq_scheduleexec"' in q["sql"]
+        ]
+        self.assertEqual(len(schedule_reads), 3)
+        self.assertQueue(5, state=TaskExec.States.SUCCEEDED)
+
     def test_named_queues(self):
         """Checking named queues"""
 
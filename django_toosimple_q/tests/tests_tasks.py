@@ -1,6 +1,8 @@
 import datetime
+from unittest import mock
 
 from django.core import management
+from django.db.models import QuerySet
 from django.utils import timezone
 from freezegun import freeze_time
 
@@ -8,6 +10,7 @@ from django_toosimple_q.decorators import register_task
 from django_toosimple_q.models import TaskExec
 
 from .base import TooSimpleQRegularTestCase
+from .utils import is_postgres
 
 
 class TestTasks(TooSimpleQRegularTestCase):
@@ -129,7 +132,7 @@ class TestTasks(TooSimpleQRegularTestCase):
         self.assertEqual(t3.state, TaskExec.States.SLEEPING)
         self.assertEqual(t4.state, TaskExec.States.SLEEPING)
 
-        # We move to the future, due tasks are now queued, and the first due one is run
+        # We move to the future, tasks are now due, and the first due one is run
         frozen_datetime.move_to(datetime.datetime(2020, 1, 1, 5))
         management.call_command("worker", "--once")
         t1.refresh_from_db()
@@ -138,7 +141,7 @@ class TestTasks(TooSimpleQRegularTestCase):
         t4.refresh_from_db()
         self.assertEqual(t1.state, TaskExec.States.SUCCEEDED)
         self.assertEqual(t2.state, TaskExec.States.SUCCEEDED)
-        self.assertEqual(t3.state, TaskExec.States.QUEUED)
+        self.assertEqual(t3.state, TaskExec.States.SLEEPING)
         self.assertEqual(t4.state, TaskExec.States.SUCCEEDED)
 
         # Now the last one is run too
@@ -294,6 +297,125 @@ class TestTasks(TooSimpleQRegularTestCase):
         self.assertQueue(2, task_name="normal", state=TaskExec.States.SUCCEEDED)
         self.assertQueue(6)
 
+        # Checking uniqueness needs a single lookup (plus notifying workers on postgres)
+        with self.assertNumQueries(1):
+            unique.queue(1)
+        with self.assertNumQueries(3 if is_postgres() else 2):
+            unique.queue(2)
+        self.assertQueue(7)
+
+    def test_task_queue_many(self):
+        """Checking bulk queuing"""
+
+        @register_task(name="a")
+        def a(x, y=1):
+            return x * y
+
+        with self.assertNumQueries(2 if is_postgres() else 1):
+            task_execs = a.queue_many(((i,), {"y": 2}, None) for i in range(10))
+
+        self.assertEqual(len(task_execs), 10)
+        self.assertQueue(10, state=TaskExec.States.QUEUED)
+
+        management.call_command("worker", "--until_done")
+
+        self.assertQueue(10, state=TaskExec.States.SUCCEEDED)
+        self.assertEqual(
+            sorted(TaskExec.objects.values_list("result", flat=True)),
+            [i * 2 for i in range(10)],
+        )
+
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_task_enqueue_many_unique(self, frozen_datetime):
+        """Checking bulk queuing behaves like successive queuing for unique tasks"""
+
+        @register_task(name="unique", unique=True)
+        def unique(x):
+            return x * 2
+
+        def getQueue():
+            return sorted(
+                (t.args, t.state, f"{t.due:%H:%M}") for t in TaskExec.objects.all()
+            )
+
+        in_1h = timezone.now() + datetime.timedelta(hours=1)
+        in_2h = timezone.now() + datetime.timedelta(hours=2)
+
+        unique.queue(1)
+        unique.queue(2, due=in_2h)
+        unique.queue(3, due=in_2h)
+
+        results = unique.queue_many(
+            [
+                ((1,), {}, None),  # already queued
+                ((2,), {}, in_1h),  # moves the sleeping task earlier
+                ((3,), {}, None),  # wakes up the sleeping task
+                ((4,), {}, in_2h),  # created
+                ((4,), {}, in_1h),  # moves the created task earlier
+                ((5,), {}, None),  # created
+                ((5,), {}, None),  # already created
+            ]
+        )
+        self.assertEqual(
+            [r is not False for r in results],
+            [False, False, False, True, False, True, False],
+        )
+        self.assertEqual(
+            getQueue(),
+            [
+                ((1,), TaskExec.States.QUEUED, "00:00"),
+                ((2,), TaskExec.States.SLEEPING, "01:00"),
+                ((3,), TaskExec.States.QUEUED, "00:00"),
+                ((4,), TaskExec.States.SLEEPING, "01:00"),
+                ((5,), TaskExec.States.QUEUED, "00:00"),
+            ],
+        )
+
+    def test_task_enqueue_many_unique_mixed(self):
+        """Checking bulk queuing deduplicates against tasks queued individually"""
+
+        @register_task(name="unique", unique=True)
+        def unique(x):
+            return x * 2
+
+        unique.queue(1)
+        results = unique.queue_many([([1], {}, None), ([2], {}, None)])
+        self.assertEqual([r is not False for r in results], [False, True])
+        self.assertEqual(unique.queue(2), False)
+        self.assertQueue(2, state=TaskExec.States.QUEUED)
+
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_task_enqueue_many_claimed(self, frozen_datetime):
+        """Checking bulk queuing doesn't alter tasks picked up concurrently"""
+
+        @register_task(name="unique", unique=True)
+        def unique(x):
+            return x * 2
+
+        in_1h = timezone.now() + datetime.timedelta(hours=1)
+        in_2h = timezone.now() + datetime.timedelta(hours=2)
+
+        bulk_update = QuerySet.bulk_update
+
+        def claim_then_bulk_update(queryset, *args, **kwargs):
+            # Simulates a worker claiming the task between the lookup and the update
+            TaskExec.objects.update(state=TaskExec.States.PROCESSING)
+            return bulk_update(queryset, *args, **kwargs)
+
+        for due in [in_1h, None]:
+            TaskExec.objects.all().delete()
+            unique.queue(1, due=in_2h)
+            with mock.patch.object(
+                QuerySet,
+                "bulk_update",
+                autospec=True,
+                side_effect=claim_then_bulk_update,
+            ):
+                unique.queue_many([((1,), {}, due)])
+            task_exec = TaskExec.objects.get()
+            self.assertEqual(task_exec.state, TaskExec.States.PROCESSING)
+            self.assertEqual(task_exec.due, in_2h)
+
     def test_task_retries(self):
         """Checking task retries"""
 
@@ -577,6 +699,35 @@ class TestTasks(TooSimpleQRegularTestCase):
             ],
         )
 
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_task_queue_unique_overdue(self, frozen_datetime):
+        """Checking queuing a unique task that is already due doesn't delay it"""
+
+        @register_task(name="my_task", unique=True)
+        def my_task(x):
+            return x * 2
+
+        @register_task(name="other_task")
+        def other_task(x):
+            return x * 2
+
+        my_task.queue(1, due=timezone.now() + datetime.timedelta(hours=1))
+        frozen_datetime.move_to(datetime.datetime(2020, 1, 1, 2))
+        other_task.queue(1)
+
+        # The sleeping task is already due, so it's left as is
+        self.assertEqual(my_task.queue(1), False)
+        self.assertEqual(my_task.queue_many([((1,), {}, None)]), [False])
+        task_exec = TaskExec.objects.get(task_name="my_task")
+        self.assertEqual(task_exec.state, TaskExec.States.SLEEPING)
+        self.assertEqual(f"{task_exec.due:%H:%M}", "01:00")
+
+        # And it's still run before the task queued after its due date
+        management.call_command("worker", "--once")
+        task_exec.refresh_from_db()
+        self.assertEqual(task_exec.state, TaskExec.States.SUCCEEDED)
+        self.assertQueue(1, task_name="other_task", state=TaskExec.States.QUEUED)
+
     def test_named_queues(self):
         """Checking named queues"""
 
@@ -698,3 +849,22 @@ class TestTasks(TooSimpleQRegularTestCase):
         self.assertTask(task_f, TaskExec.States.SUCCEEDED)
         self.assertTask(task_g, TaskExec.States.SUCCEEDED)
         self.assertTask(task_h, TaskExec.States.SUCCEEDED)
+
+    @freeze_time("2020-01-01", as_kwarg="frozen_datetime")
+    def test_task_sortable_time(self, frozen_datetime):
+        """Checking the sortable time follows the latest time of the task"""
+
+        @register_task(name="a")
+        def a(x):
+            frozen_datetime.tick(datetime.timedelta(minutes=5))
+            return x * 2
+
+        t = a.queue(1, due=timezone.now() + datetime.timedelta(hours=1))
+        t.refresh_from_db()
+        self.assertEqual(f"{t.sortable_time:%H:%M}", "01:00")
+
+        frozen_datetime.tick(datetime.timedelta(hours=2))
+        management.call_command("worker", "--once")
+        t.refresh_from_db()
+        self.assertEqual(f"{t.started:%H:%M}", "02:00")
+        self.assertEqual(f"{t.sortable_time:%H:%M}", "02:05")